@@ -4,6 +4,20 @@ from setuptools import find_packages
 with open('README.rst') as file:
     long_description = file.read()
 
+# If Cython is available, compile the pool module to a C extension to cut the
+# interpreter overhead of the borrow path; the pure-Python module is always
+# installed too, and is used whenever the extension is not built.
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize(['src/geventconnpool/pool.py'],
+                            compiler_directives={'language_level': 3})
+    # A failed compilation (eg: no C compiler) must not fail the install
+    for e in ext_modules:
+        e.optional = True
+
 setup(name='geventconnpool',
     version = "0.2.1",
     description = 'TCP connection pool for gevent',
@@ -14,6 +28,7 @@ setup(name='geventconnpool',
     packages=find_packages('src'),
     package_dir={'': 'src'},
     include_package_data=True,
+    ext_modules=ext_modules,
     install_requires=[
         'gevent >= 0.13'
     ],
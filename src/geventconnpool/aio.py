@@ -0,0 +1,331 @@
+"""
+asyncio flavour of the connection pool, for applications not based on
+gevent (Python 3.7+). It mirrors the API of geventconnpool.pool, with
+coroutines in place of blocking calls:
+
+    class MyPool(AsyncConnectionPool):
+        async def _new_connection(self):
+            return await asyncio.open_connection('test.example.org', 2485)
+
+        async def _close_connection(self, c):
+            reader, writer = c
+            writer.close()
+            await writer.wait_closed()
+
+    async with pool.get() as (reader, writer):
+        ...
+"""
+import asyncio
+import logging
+import random
+from collections import deque
+from functools import wraps
+from itertools import chain, repeat
+from time import monotonic
+
+__all__ = ["AsyncConnectionPool", "retry"]
+
+# socket.error is an alias of OSError on Python 3
+DEFAULT_EXC_CLASSES = (OSError,)
+
+# Delays between failed attempts at opening a new connection (the last one
+# is repeated forever)
+_BACKOFF = tuple(min(0.1 * 2 ** i, 400.0) for i in range(14))
+
+
+class AsyncConnectionPool(object):
+    """
+    Generic TCP connection pool for asyncio, with the following features:
+        * Configurable pool size
+        * Auto-reconnection when a broken socket is detected
+        * Optional periodic keepalive
+
+    The pool must be instantiated from within a running event loop.
+    """
+
+    __slots__ = ('size', 'conn', '_in_use', '_waiters', '_tasks', '_closed',
+                 '_reconnects', '_reconnect_event', 'keepalive', 'exc_classes')
+
+    # Frequency at which new connections are opened (at startup, and after
+    # failures)
+    SPAWN_FREQUENCY = 0.1
+
+    # Delay before replacing connections that failed
+    RECONNECT_DELAY = 1
+
+    def __init__(self, size, exc_classes=DEFAULT_EXC_CLASSES, keepalive=None):
+        self.size = size
+        # Never holds more than size connections
+        self.conn = deque(maxlen=size)
+        # Connections currently borrowed through get(), by id()
+        self._in_use = {}
+        # Futures of the tasks blocked in get() waiting for a connection, in
+        # FIFO order
+        self._waiters = deque()
+        # The event loop only keeps weak references to tasks; they are also
+        # cancelled by close_all()
+        self._tasks = set()
+        self._closed = False
+        # Number of connections to be opened by _reconnector, starting with
+        # the whole pool
+        self._reconnects = size
+        self._reconnect_event = asyncio.Event()
+        self._reconnect_event.set()
+        self.keepalive = keepalive
+        # Exceptions list must be in tuple form to be caught properly
+        self.exc_classes = tuple(exc_classes)
+        self._spawn(self._reconnector())
+        if self.keepalive:
+            self._spawn(self._keepalive_periodic())
+
+    async def _new_connection(self):
+        """
+        Estabilish a new connection (to be implemented in subclasses).
+        """
+        raise NotImplementedError
+
+    async def _keepalive(self, c):
+        """
+        Implement actual application-level keepalive (to be
+        reimplemented in subclasses).
+
+        :raise: OSError if the connection has been closed or is broken.
+        """
+        raise NotImplementedError()
+
+    async def _close_connection(self, c):
+        """
+        Close a connection, on behalf of close_all() (can be reimplemented
+        in subclasses if connections are not closed through c.close()).
+        """
+        c.close()
+
+    async def close_all(self):
+        """
+        Close all the connections of the pool, both idle and in use; meant
+        to be called at shutdown.
+
+        Background tasks are cancelled, and connections still being opened
+        are closed as soon as they are established. Tasks waiting in get(),
+        and any later get(), raise RuntimeError. If closing a connection
+        fails, the others are closed anyway and the first error is raised at
+        the end.
+        """
+        self._closed = True
+        self._reconnects = 0
+        waiters = self._waiters
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(
+                    RuntimeError("connection pool is closed"))
+        current = asyncio.current_task()
+        for task in list(self._tasks):
+            if task is not current:
+                task.cancel()
+        conns = list(self.conn)
+        conns.extend(self._in_use.values())
+        self.conn.clear()
+        self._in_use.clear()
+        error = None
+        for c in conns:
+            try:
+                await self._close_connection(c)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _reconnector(self):
+        # See ConnectionPool._reconnector
+        event = self._reconnect_event
+        sleep = asyncio.sleep
+        delay = 0
+        while 1:
+            await event.wait()
+            await sleep(delay)
+            event.clear()
+            delay = self.RECONNECT_DELAY
+            count, self._reconnects = self._reconnects, 0
+            for i in range(count):
+                self._spawn(self._addOne())
+                await sleep(self.SPAWN_FREQUENCY)
+
+    def _schedule_reconnect(self):
+        self._reconnects += 1
+        self._reconnect_event.set()
+
+    async def _keepalive_periodic(self):
+        delay = float(self.keepalive) / self.size
+        conns = self.conn
+        get_nowait = self.get_nowait
+        keepalive = self._keepalive
+        exc_classes = self.exc_classes
+        sleep = asyncio.sleep
+        while 1:
+            start = monotonic()
+            # Ping the idle connection unused for the longest time, see
+            # ConnectionPool._keepalive_periodic.
+            if conns:
+                conns.rotate(1)
+                try:
+                    async with get_nowait() as c:
+                        await keepalive(c)
+                except exc_classes:
+                    # Nothing to do, the pool will generate a new connection
+                    # later
+                    pass
+            await sleep(max(0.0, delay - (monotonic() - start)))
+
+    async def _addOne(self):
+        new_connection = self._new_connection
+        sleep = asyncio.sleep
+        for stime in chain(_BACKOFF, repeat(_BACKOFF[-1])):
+            c = await new_connection()
+            if c:
+                break
+            await sleep(stime * (0.5 + random.random()))
+
+        await self._put(c)
+
+    async def _put(self, c):
+        if self._closed:
+            await self._close_connection(c)
+            return
+        # Hand the connection straight to the first task waiting in get(),
+        # if any, so that tasks calling get() meanwhile cannot overtake it.
+        waiters = self._waiters
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(c)
+                return
+        # Most recently used connections are handed out first
+        self.conn.appendleft(c)
+
+    async def _wait(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except BaseException:
+            # We were cancelled while waiting: if a connection was already
+            # handed over to us, pass it on.
+            if waiter.done() and not waiter.cancelled() \
+                    and waiter.exception() is None:
+                await self._put(waiter.result())
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def get(self):
+        """
+        Get a connection from the pool, to make and receive traffic.
+
+        If the connection fails for any reason (OSError), it is dropped
+        and a new one is scheduled. Please use @retry as a way to automatically
+        retry whatever operation you were performing.
+        """
+        return _AsyncPoolBorrow(self, True)
+
+    def get_nowait(self):
+        """
+        Like get(), but never wait for a connection to be available: entering
+        the context raises asyncio.QueueEmpty if all of them are in use.
+        """
+        return _AsyncPoolBorrow(self, False)
+
+
+class _AsyncPoolBorrow(object):
+    """
+    Asynchronous context manager returned by AsyncConnectionPool.get(),
+    holding the borrowed connection for the duration of the ``async with``
+    block.
+    """
+
+    __slots__ = ('pool', 'block', 'conn')
+
+    def __init__(self, pool, block):
+        self.pool = pool
+        self.block = block
+        self.conn = None
+
+    async def __aenter__(self):
+        pool = self.pool
+        if pool._closed:
+            raise RuntimeError("connection pool is closed")
+        conns = pool.conn
+        if conns:
+            c = conns.popleft()
+        elif self.block:
+            c = await pool._wait()
+        else:
+            raise asyncio.QueueEmpty
+        self.conn = c
+        pool._in_use[id(c)] = c
+        return c
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        pool = self.pool
+        c = self.conn
+        self.conn = None
+        # Exceptions are never swallowed: every path returns False
+        if pool._in_use.pop(id(c), None) is None:
+            # Closed by close_all() while borrowed
+            return False
+        if exc_type is None:
+            await pool._put(c)
+            return False
+        if issubclass(exc_type, pool.exc_classes):
+            # The current connection has failed: it MUST NOT be reused, drop
+            # it and create a new one
+            pool._schedule_reconnect()
+        else:
+            # An exception with no special meaning for us
+            await pool._put(c)
+        return False
+
+
+def retry(f, exc_classes=DEFAULT_EXC_CLASSES, logger=None,
+          retry_log_level=logging.INFO,
+          retry_log_message="Connection broken in '{f}' (error: '{e}'); "
+                            "retrying with new connection.",
+          max_failures=None, interval=0,
+          max_failure_log_level=logging.ERROR,
+          max_failure_log_message="Max retries reached for '{f}'. Aborting."):
+    """
+    Decorator to automatically reexecute a coroutine function if the
+    connection is broken for any reason.
+    """
+    exc_classes = tuple(exc_classes)
+    # Callables like functools.partial have no __name__
+    fname = getattr(f, '__name__', repr(f))
+    sleep = asyncio.sleep
+    if max_failures is None:
+        max_failures = float('inf')
+
+    @wraps(f)
+    async def deco(*args, **kwargs):
+        failures = 0
+        while True:
+            try:
+                return await f(*args, **kwargs)
+            except exc_classes as e:
+                if logger is not None:
+                    logger.log(retry_log_level,
+                               retry_log_message.format(f=fname, e=e))
+                await sleep(interval)
+                failures += 1
+                if failures > max_failures:
+                    if logger is not None:
+                        logger.log(max_failure_log_level,
+                                   max_failure_log_message.format(
+                                       f=fname, e=e))
+                    raise
+    return deco
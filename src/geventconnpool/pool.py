@@ -1,16 +1,27 @@
 import logging
+import random
 
 import gevent
-from gevent.lock import BoundedSemaphore
+from gevent.event import AsyncResult, Event
+from gevent.queue import Empty
 from gevent import socket
 from collections import deque
-from contextlib import contextmanager
 from functools import wraps
+from itertools import chain, repeat
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
 
 __all__ = ["ConnectionPool", "retry"]
 
 DEFAULT_EXC_CLASSES = (socket.error,)
 
+# Delays between failed attempts at opening a new connection (the last one
+# is repeated forever)
+_BACKOFF = tuple(min(0.1 * 2 ** i, 400.0) for i in range(14))
+
 
 class ConnectionPool(object):
     """
@@ -18,29 +29,47 @@ class ConnectionPool(object):
         * Configurable pool size
         * Auto-reconnection when a broken socket is detected
         * Optional periodic keepalive
+
+    Instances have fixed attributes (__slots__), which keeps attribute access
+    cheap and the type stable for JIT-based interpreters like PyPy. Subclasses
+    that need per-pool state should declare it in their own __slots__, and
+    should not override get() or the methods it relies on (_put, _wait).
     """
 
-    # Frequency at which the pool is populated at startup
+    __slots__ = ('size', 'conn', '_in_use', '_waiters', '_greenlets',
+                 '_closed', '_reconnects', '_reconnect_event', 'keepalive',
+                 'exc_classes')
+
+    # Frequency at which new connections are opened (at startup, and after
+    # failures)
     SPAWN_FREQUENCY = 0.1
 
+    # Delay before replacing connections that failed
+    RECONNECT_DELAY = 1
+
     def __init__(self, size, exc_classes=DEFAULT_EXC_CLASSES, keepalive=None):
         self.size = size
-        self.conn = deque()
-        self.lock = BoundedSemaphore(size)
+        # Never holds more than size connections
+        self.conn = deque(maxlen=size)
+        # Connections currently borrowed through get(), by id()
+        self._in_use = {}
+        # Greenlets blocked in get() waiting for a connection, in FIFO order
+        self._waiters = deque()
+        # Background greenlets (reconnector, keepalive, _addOne), killed by
+        # close_all()
+        self._greenlets = set()
+        self._closed = False
+        # Number of connections to be opened by _reconnector, starting with
+        # the whole pool
+        self._reconnects = size
+        self._reconnect_event = Event()
+        self._reconnect_event.set()
         self.keepalive = keepalive
         # Exceptions list must be in tuple form to be caught properly
         self.exc_classes = tuple(exc_classes)
-        # http://stackoverflow.com/a/31136897/357578
-        try:
-            xrange
-        except NameError:
-            xrange = range
-        for i in xrange(size):
-            self.lock.acquire()
-        for i in xrange(size):
-            gevent.spawn_later(self.SPAWN_FREQUENCY*i, self._addOne)
+        self._spawn(self._reconnector)
         if self.keepalive:
-            gevent.spawn(self._keepalive_periodic)
+            self._spawn(self._keepalive_periodic)
 
     def _new_connection(self):
         """
@@ -57,31 +86,144 @@ class ConnectionPool(object):
         """
         raise NotImplementedError()
 
+    def _close_connection(self, c):
+        """
+        Close a connection, on behalf of close_all() (can be reimplemented
+        in subclasses if connections are not closed through c.close()).
+        """
+        c.close()
+
+    def close_all(self):
+        """
+        Close all the connections of the pool, both idle and in use; meant
+        to be called at shutdown.
+
+        Background greenlets are stopped, and connections still being opened
+        are closed as soon as they are established. Greenlets waiting in
+        get(), and any later get(), raise RuntimeError. If closing a
+        connection fails, the others are closed anyway and the first error
+        is raised at the end.
+        """
+        self._closed = True
+        self._reconnects = 0
+        waiters = self._waiters
+        while waiters:
+            waiters.popleft().set_exception(
+                RuntimeError("connection pool is closed"))
+        current = gevent.getcurrent()
+        gevent.killall([g for g in self._greenlets if g is not current])
+        conns = list(self.conn)
+        conns.extend(self._in_use.values())
+        self.conn.clear()
+        self._in_use.clear()
+        error = None
+        for c in conns:
+            try:
+                self._close_connection(c)
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+    def _spawn(self, func):
+        g = gevent.spawn(func)
+        self._greenlets.add(g)
+        g.link(self._greenlets.discard)
+
+    def _reconnector(self):
+        # Single greenlet opening all new connections, at most one every
+        # SPAWN_FREQUENCY seconds, so that when many connections break at
+        # once (eg: the remote peer restarted), they are not all reopened
+        # at the same time.
+        event = self._reconnect_event
+        sleep = gevent.sleep
+        # No delay for populating the pool at startup
+        delay = 0
+        while 1:
+            event.wait()
+            # Failures happening meanwhile are handled by this same round
+            sleep(delay)
+            event.clear()
+            delay = self.RECONNECT_DELAY
+            # Failures happening while this round is in progress set the
+            # event again, and get their own round after RECONNECT_DELAY
+            count, self._reconnects = self._reconnects, 0
+            for i in range(count):
+                self._spawn(self._addOne)
+                sleep(self.SPAWN_FREQUENCY)
+
+    def _schedule_reconnect(self):
+        self._reconnects += 1
+        self._reconnect_event.set()
+
     def _keepalive_periodic(self):
         delay = float(self.keepalive) / self.size
+        conns = self.conn
+        get_nowait = self.get_nowait
+        keepalive = self._keepalive
+        exc_classes = self.exc_classes
+        sleep = gevent.sleep
         while 1:
-            try:
-                with self.get() as c:
-                    self._keepalive(c)
-            except self.exc_classes:
-                # Nothing to do, the pool will generate a new connection later
-                pass
-            gevent.sleep(delay)
+            start = monotonic()
+            # Connections in use need no keepalive. Among the idle ones, ping
+            # the one unused for the longest time, at the tail of the deque,
+            # by moving it to the head where get_nowait() takes it from.
+            if conns:
+                conns.rotate(1)
+                try:
+                    with get_nowait() as c:
+                        keepalive(c)
+                except exc_classes:
+                    # Nothing to do, the pool will generate a new connection
+                    # later
+                    pass
+            # Discount the time spent in the keepalive itself, so that the
+            # period does not drift with the network latency
+            sleep(max(0.0, delay - (monotonic() - start)))
 
     def _addOne(self):
-        stime = 0.1
-        while 1:
-            c = self._new_connection()
+        new_connection = self._new_connection
+        sleep = gevent.sleep
+        for stime in chain(_BACKOFF, repeat(_BACKOFF[-1])):
+            c = new_connection()
             if c:
                 break
-            gevent.sleep(stime)
-            if stime < 400:
-                stime *= 2
+            # Add jitter, so that connections failing together do not all
+            # retry at the same time
+            sleep(stime * (0.5 + random.random()))
 
-        self.conn.append(c)
-        self.lock.release()
+        self._put(c)
+
+    def _put(self, c):
+        # Hand the connection straight to the first greenlet waiting in
+        # get(), if any, so that it does not go through the deque.
+        if self._closed:
+            self._close_connection(c)
+            return
+        waiters = self._waiters
+        if waiters:
+            waiters.popleft().set(c)
+        else:
+            # Most recently used connections are handed out first, as they
+            # are the most likely to be still alive and warm (TCP window,
+            # TLS session).
+            self.conn.appendleft(c)
+
+    def _wait(self):
+        waiter = AsyncResult()
+        self._waiters.append(waiter)
+        try:
+            return waiter.get()
+        except:
+            # We were killed (or timed out) while waiting: if a connection
+            # was already handed over to us, pass it on.
+            if waiter.successful():
+                self._put(waiter.get())
+            elif not waiter.ready():
+                self._waiters.remove(waiter)
+            raise
 
-    @contextmanager
     def get(self):
         """
         Get a connection from the pool, to make and receive traffic.
@@ -90,23 +232,67 @@ class ConnectionPool(object):
         and a new one is scheduled. Please use @retry as a way to automatically
         retry whatever operation you were performing.
         """
-        self.lock.acquire()
-        try:
-            c = self.conn.popleft()
-            yield c
-        except self.exc_classes:
-            # The current connection has failed, drop it and create a new one
-            gevent.spawn_later(1, self._addOne)
-            raise
-        except:
-            self.conn.append(c)
-            self.lock.release()
-            raise
+        return _PoolBorrow(self, True)
+
+    def get_nowait(self):
+        """
+        Like get(), but never wait for a connection to be available: entering
+        the context raises gevent.queue.Empty if all of them are in use.
+        """
+        return _PoolBorrow(self, False)
+
+
+class _PoolBorrow(object):
+    """
+    Context manager returned by ConnectionPool.get(), holding the borrowed
+    connection for the duration of the ``with`` block.
+    """
+
+    __slots__ = ('pool', 'block', 'conn')
+
+    def __init__(self, pool, block):
+        self.pool = pool
+        self.block = block
+        self.conn = None
+
+    def __enter__(self):
+        pool = self.pool
+        # The connection must leave the deque while it is borrowed (rather
+        # than peeking at conn[0] and rotating on release): other greenlets
+        # may call get() before it is returned, and must not be given the
+        # same connection.
+        if pool._closed:
+            raise RuntimeError("connection pool is closed")
+        conns = pool.conn
+        if conns:
+            c = conns.popleft()
+        elif self.block:
+            c = pool._wait()
+        else:
+            raise Empty
+        pool._in_use[id(c)] = c
+        self.conn = c
+        return c
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pool = self.pool
+        c = self.conn
+        self.conn = None
+        # Exceptions are never swallowed: every path returns False
+        if pool._in_use.pop(id(c), None) is None:
+            # Closed by close_all() while borrowed
+            return False
+        if exc_type is None:
+            pool._put(c)
+            return False
+        if issubclass(exc_type, pool.exc_classes):
+            # The current connection has failed (socket.error): it MUST NOT
+            # be reused, drop it and create a new one
+            pool._schedule_reconnect()
         else:
-            # NOTE: cannot use finally because MUST NOT reuse the connection
-            # if it failed (socket.error)
-            self.conn.append(c)
-            self.lock.release()
+            # An exception with no special meaning for us
+            pool._put(c)
+        return False
 
 
 def retry(f, exc_classes=DEFAULT_EXC_CLASSES, logger=None,
@@ -121,6 +307,12 @@ def retry(f, exc_classes=DEFAULT_EXC_CLASSES, logger=None,
     broken for any reason.
     """
     exc_classes = tuple(exc_classes)
+    # Callables like functools.partial have no __name__
+    fname = getattr(f, '__name__', repr(f))
+    sleep = gevent.sleep
+    # A single comparison per failure, even when retrying forever
+    if max_failures is None:
+        max_failures = float('inf')
 
     @wraps(f)
     def deco(*args, **kwargs):
@@ -131,14 +323,13 @@ def retry(f, exc_classes=DEFAULT_EXC_CLASSES, logger=None,
             except exc_classes as e:
                 if logger is not None:
                     logger.log(retry_log_level,
-                               retry_log_message.format(f=f.func_name, e=e))
-                gevent.sleep(interval)
+                               retry_log_message.format(f=fname, e=e))
+                sleep(interval)
                 failures += 1
-                if max_failures is not None \
-                        and failures > max_failures:
+                if failures > max_failures:
                     if logger is not None:
                         logger.log(max_failure_log_level,
                                    max_failure_log_message.format(
-                                       f=f.func_name, e=e))
+                                       f=fname, e=e))
                     raise
     return deco
@@ -0,0 +1,202 @@
+import asyncio
+import unittest
+
+from geventconnpool.aio import AsyncConnectionPool
+
+
+class Conn(object):
+    def __init__(self, n):
+        self.n = n
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubPool(AsyncConnectionPool):
+    SPAWN_FREQUENCY = 0.01
+
+    def __init__(self, size, **kwargs):
+        self.opened = []
+        self.open_times = []
+        # When set, _new_connection blocks until it is released
+        self.gate = None
+        super(StubPool, self).__init__(size, **kwargs)
+
+    async def _new_connection(self):
+        if self.gate is not None:
+            await self.gate.wait()
+        c = Conn(len(self.opened))
+        self.opened.append(c)
+        self.open_times.append(asyncio.get_running_loop().time())
+        return c
+
+
+async def wait_full(pool):
+    async def poll():
+        while len(pool.conn) < pool.size:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), 2)
+
+
+async def fail_one(pool):
+    try:
+        async with pool.get() as c:
+            raise OSError("broken")
+    except OSError:
+        return c
+
+
+class TestWaiters(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.pool = StubPool(1)
+        await wait_full(self.pool)
+
+    async def asyncTearDown(self):
+        await self.pool.close_all()
+
+    async def test_fifo_handoff(self):
+        served = []
+
+        async def waiter(name):
+            async with self.pool.get():
+                served.append(name)
+
+        async with self.pool.get():
+            tasks = [asyncio.ensure_future(waiter(i)) for i in range(3)]
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        self.assertEqual(served, [0, 1, 2])
+
+    async def test_waiter_not_starved(self):
+        served = []
+
+        async def hog():
+            for i in range(200):
+                async with self.pool.get():
+                    served.append('hog')
+                    await asyncio.sleep(0)
+
+        async def waiter():
+            await asyncio.sleep(0)
+            async with self.pool.get():
+                served.append('waiter')
+
+        await asyncio.wait_for(asyncio.gather(hog(), waiter()), 2)
+        self.assertLess(served.index('waiter'), 5)
+
+    async def test_waiter_timeout(self):
+        async def borrow():
+            async with self.pool.get():
+                pass
+
+        async with self.pool.get() as c:
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(borrow(), 0.01)
+        self.assertEqual(list(self.pool._waiters), [])
+        self.assertEqual(list(self.pool.conn), [c])
+
+    async def test_cancelled_waiter_passes_connection_on(self):
+        served = []
+
+        async def waiter(name):
+            async with self.pool.get() as c:
+                served.append((name, c))
+
+        async with self.pool.get() as c:
+            first = asyncio.ensure_future(waiter('first'))
+            second = asyncio.ensure_future(waiter('second'))
+            await asyncio.sleep(0.01)
+        # The connection has been handed over to the first waiter, which is
+        # cancelled before it gets to run
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        self.assertEqual(served, [('second', c)])
+        self.assertEqual(list(self.pool.conn), [c])
+
+
+class TestReconnect(unittest.IsolatedAsyncioTestCase):
+
+    async def test_reconnect_delay(self):
+        pool = StubPool(1)
+        self.assertEqual(AsyncConnectionPool.RECONNECT_DELAY, 1)
+        await wait_full(pool)
+        start = asyncio.get_running_loop().time()
+        await fail_one(pool)
+        await asyncio.sleep(0.8)
+        self.assertEqual(len(pool.opened), 1)
+        await asyncio.sleep(0.4)
+        self.assertEqual(len(pool.opened), 2)
+        self.assertGreaterEqual(pool.open_times[1] - start, 0.95)
+        await pool.close_all()
+
+    async def test_burst_is_rate_limited(self):
+        pool = StubPool(5)
+        pool.SPAWN_FREQUENCY = 0.05
+        pool.RECONNECT_DELAY = 0.1
+        await wait_full(pool)
+        for i in range(5):
+            await fail_one(pool)
+        await wait_full(pool)
+        times = pool.open_times[5:]
+        self.assertEqual(len(times), 5)
+        for prev, cur in zip(times, times[1:]):
+            self.assertGreaterEqual(cur - prev, 0.04)
+        await pool.close_all()
+
+
+class TestCloseAll(unittest.IsolatedAsyncioTestCase):
+
+    async def test_close_all(self):
+        pool = StubPool(3)
+        await wait_full(pool)
+        async with pool.get() as borrowed:
+            # Keep the replacement of the failed connection in flight
+            pool.gate = asyncio.Event()
+            failed = await fail_one(pool)
+            await asyncio.sleep(1.1)
+            await pool.close_all()
+            pool.gate.set()
+        await asyncio.sleep(0.1)
+        self.assertTrue(borrowed.closed)
+        self.assertFalse(failed.closed)
+        self.assertEqual(len(pool.opened), 3)
+        self.assertTrue(all(c.closed for c in pool.opened if c is not failed))
+        self.assertEqual(list(pool.conn), [])
+        self.assertEqual(pool._in_use, {})
+        self.assertEqual(pool._tasks, set())
+
+    async def test_close_all_fails_waiters(self):
+        pool = StubPool(1)
+        await wait_full(pool)
+
+        async def borrow():
+            async with pool.get():
+                pass
+
+        async with pool.get():
+            task = asyncio.ensure_future(borrow())
+            await asyncio.sleep(0.01)
+            await pool.close_all()
+        with self.assertRaises(RuntimeError):
+            await asyncio.wait_for(task, 1)
+        with self.assertRaises(RuntimeError):
+            await borrow()
+
+    async def test_close_errors(self):
+        class FailingConn(Conn):
+            def close(self):
+                Conn.close(self)
+                raise IOError("close failed")
+
+        pool = StubPool(2)
+        await wait_full(pool)
+        pool.conn[0].__class__ = FailingConn
+        with self.assertRaises(IOError):
+            await pool.close_all()
+        self.assertTrue(all(c.closed for c in pool.opened))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import unittest
+
+import gevent
+from gevent import socket
+from gevent.event import Event
+
+from geventconnpool import ConnectionPool
+
+
+class Conn(object):
+    def __init__(self, n):
+        self.n = n
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubPool(ConnectionPool):
+    SPAWN_FREQUENCY = 0.01
+
+    def __init__(self, size, **kwargs):
+        self.opened = []
+        self.open_times = []
+        # When set, _new_connection blocks until it is released
+        self.gate = None
+        super(StubPool, self).__init__(size, **kwargs)
+
+    def _new_connection(self):
+        if self.gate is not None:
+            self.gate.wait()
+        c = Conn(len(self.opened))
+        self.opened.append(c)
+        self.open_times.append(gevent.get_hub().loop.now())
+        return c
+
+
+def wait_full(pool):
+    with gevent.Timeout(2):
+        while len(pool.conn) < pool.size:
+            gevent.sleep(0.01)
+
+
+def fail_one(pool):
+    try:
+        with pool.get() as c:
+            raise socket.error("broken")
+    except socket.error:
+        return c
+
+
+class TestWaiters(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = StubPool(1)
+        wait_full(self.pool)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def test_fifo_handoff(self):
+        served = []
+
+        def waiter(name):
+            with self.pool.get():
+                served.append(name)
+
+        with self.pool.get():
+            greenlets = [gevent.spawn(waiter, i) for i in range(3)]
+            gevent.sleep(0.01)
+        gevent.joinall(greenlets, timeout=1)
+        self.assertEqual(served, [0, 1, 2])
+
+    def test_waiter_not_starved(self):
+        served = []
+
+        def hog():
+            for i in range(200):
+                with self.pool.get():
+                    served.append('hog')
+                    gevent.sleep(0)
+
+        def waiter():
+            with self.pool.get():
+                served.append('waiter')
+
+        g = gevent.spawn(hog)
+        gevent.sleep(0)
+        w = gevent.spawn(waiter)
+        gevent.joinall([g, w], timeout=2)
+        self.assertLess(served.index('waiter'), 5)
+
+    def test_waiter_timeout(self):
+        with self.pool.get() as c:
+            with self.assertRaises(gevent.Timeout):
+                with gevent.Timeout(0.01):
+                    with self.pool.get():
+                        pass
+        self.assertEqual(list(self.pool._waiters), [])
+        self.assertEqual(list(self.pool.conn), [c])
+
+    def test_killed_waiter_passes_connection_on(self):
+        served = []
+
+        def waiter(name):
+            with self.pool.get() as c:
+                served.append((name, c))
+
+        with self.pool.get() as c:
+            first = gevent.spawn(waiter, 'first')
+            second = gevent.spawn(waiter, 'second')
+            gevent.sleep(0.01)
+            # Delivered only after the connection has been handed over to
+            # the first waiter, but before it gets to run
+            first.kill(block=False)
+        second.join(1)
+        self.assertEqual(served, [('second', c)])
+        self.assertEqual(list(self.pool.conn), [c])
+
+
+class TestReconnect(unittest.TestCase):
+
+    def test_reconnect_delay(self):
+        pool = StubPool(1)
+        self.assertEqual(ConnectionPool.RECONNECT_DELAY, 1)
+        wait_full(pool)
+        start = gevent.get_hub().loop.now()
+        fail_one(pool)
+        gevent.sleep(0.8)
+        self.assertEqual(len(pool.opened), 1)
+        gevent.sleep(0.4)
+        self.assertEqual(len(pool.opened), 2)
+        self.assertGreaterEqual(pool.open_times[1] - start, 0.95)
+        pool.close_all()
+
+    def test_burst_is_rate_limited(self):
+        pool = StubPool(5)
+        pool.SPAWN_FREQUENCY = 0.05
+        pool.RECONNECT_DELAY = 0.1
+        wait_full(pool)
+        for i in range(5):
+            fail_one(pool)
+        wait_full(pool)
+        times = pool.open_times[5:]
+        self.assertEqual(len(times), 5)
+        for prev, cur in zip(times, times[1:]):
+            self.assertGreaterEqual(cur - prev, 0.04)
+        pool.close_all()
+
+
+class TestCloseAll(unittest.TestCase):
+
+    def test_close_all(self):
+        pool = StubPool(3)
+        wait_full(pool)
+        with pool.get() as borrowed:
+            # Keep the replacement of the failed connection in flight
+            pool.gate = Event()
+            failed = fail_one(pool)
+            gevent.sleep(1.1)
+            pool.close_all()
+            pool.gate.set()
+        gevent.sleep(0.1)
+        self.assertTrue(borrowed.closed)
+        self.assertFalse(failed.closed)
+        self.assertEqual(len(pool.opened), 3)
+        self.assertTrue(all(c.closed for c in pool.opened if c is not failed))
+        self.assertEqual(list(pool.conn), [])
+        self.assertEqual(pool._in_use, {})
+        self.assertEqual(pool._greenlets, set())
+
+    def test_close_all_fails_waiters(self):
+        pool = StubPool(1)
+        wait_full(pool)
+        errors = []
+
+        def waiter():
+            try:
+                with pool.get():
+                    pass
+            except RuntimeError as e:
+                errors.append(e)
+
+        with pool.get():
+            g = gevent.spawn(waiter)
+            gevent.sleep(0.01)
+            pool.close_all()
+        g.join(1)
+        self.assertEqual(len(errors), 1)
+        with self.assertRaises(RuntimeError):
+            with pool.get():
+                pass
+
+    def test_close_errors(self):
+        class FailingConn(Conn):
+            def close(self):
+                Conn.close(self)
+                raise IOError("close failed")
+
+        pool = StubPool(2)
+        wait_full(pool)
+        pool.conn[0].__class__ = FailingConn
+        with self.assertRaises(IOError):
+            pool.close_all()
+        self.assertTrue(all(c.closed for c in pool.opened))
+
+
+if __name__ == '__main__':
+    unittest.main()